@@ -4,24 +4,55 @@ Core logic for processing requests and managing tools
 Uses Ollama for local LLM inference
 """
 
-import json
+import asyncio
+import concurrent.futures
+import httpx
+import ollama
+import orjson
+import re
 import requests
+from requests.adapters import HTTPAdapter
 from m365_client import M365Client
 
+# (connect, read) seconds. The read timeout covers the gap between streamed chunks,
+# and is longer than Graph's because the first chunk can wait on a model load
+OLLAMA_TIMEOUT = (3, 120)
+
+# Tools that change Graph data; reads in the same turn must run after them
+WRITE_TOOLS = {"send_email", "create_task"}
+
 class PersonalAssistant:
-    def __init__(self, ollama_model="llama3.1", ollama_url="http://localhost:11434"):
+    def __init__(self, ollama_model="llama3.1:8b-instruct-q4_K_M", ollama_url="http://localhost:11434"):
         self.ollama_url = ollama_url
         self.ollama_model = ollama_model
+        # Fixed context/batch sizes keep the server from reallocating the KV cache between calls
+        self._ollama_options = {"temperature": 0.7, "num_ctx": 4096, "num_batch": 512}
+        self._aclient = ollama.AsyncClient(
+            host=ollama_url,
+            timeout=httpx.Timeout(OLLAMA_TIMEOUT[1], connect=OLLAMA_TIMEOUT[0])
+        )
+        self._http = requests.Session()
+        self._http.headers.update({"Content-Type": "application/json"})
+        self._http.mount(ollama_url, HTTPAdapter(pool_connections=16, pool_maxsize=32))
         #self.m365 = M365Client()
         self.conversation_history = []
         
-        # Test Ollama connection
-        try:
-            response = requests.get(f"{self.ollama_url}/api/tags")
-            if response.status_code != 200:
-                print(f"⚠️  Warning: Cannot connect to Ollama at {ollama_url}")
-        except Exception as e:
-            print(f"⚠️  Warning: Ollama connection failed: {e}")
+        # Once the history exceeds this many turns, the older half is summarized
+        self._max_turns = 8
+        
+        # Worker threads for speculative tool calls; requests releases the GIL while waiting
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self._prefetched = {}
+        # Background history summary: (history, summarized messages, future)
+        self._pending_summary = None
+        # (read keywords, write words that skip the prefetch, tool, parameters)
+        self._prefetch_rules = [
+            (("email", "inbox", "mail"), {"send", "reply", "forward", "write", "compose"}, "get_emails", {"limit": 10}),
+            (("task", "planner", "to-do", "todo"), {"create", "add", "new", "make"}, "get_tasks", {})
+        ]
+        
+        # Ollama is checked lazily on the first call, not on construction
+        self._ollama_checked = False
         
         self.tools = [
             {
@@ -60,6 +91,35 @@ class PersonalAssistant:
                 }
             }
         ]
+        
+        # Tool name -> (M365Client method, {tool parameter: method argument}).
+        # Methods are bound to self.m365 at call time
+        email_params = {"limit": "limit", "filter": "filter_str"}
+        send_params = {"to": "to", "subject": "subject", "body": "body"}
+        task_params = {"plan_id": "plan_id", "filter": "filter_str"}
+        create_params = {
+            "plan_id": "plan_id",
+            "title": "title",
+            "description": "description",
+            "due_date": "due_date"
+        }
+        self._tool_dispatch = {
+            "get_emails": (M365Client.get_emails, email_params),
+            "send_email": (M365Client.send_email, send_params),
+            "get_tasks": (M365Client.get_tasks, task_params),
+            "create_task": (M365Client.create_task, create_params)
+        }
+        # Same tools mapped to the coroutine methods, used by aexecute_tool
+        self._atool_dispatch = {
+            "get_emails": (M365Client.aget_emails, email_params),
+            "send_email": (M365Client.asend_email, send_params),
+            "get_tasks": (M365Client.aget_tasks, task_params),
+            "create_task": (M365Client.acreate_task, create_params)
+        }
+        
+        # Tools are static, so build the system prompt once. Keeping it byte-identical
+        # across turns also lets Ollama reuse its cached prompt prefix
+        self._system_message = {"role": "system", "content": self._create_system_prompt()}
     
     def _create_system_prompt(self):
         """Create system prompt with tool descriptions"""
@@ -77,6 +137,12 @@ Available tools:
 When you need to use a tool, respond ONLY with a JSON object in this format:
 {{"tool": "tool_name", "parameters": {{"param1": "value1", "param2": "value2"}}}}
 
+When the request needs several independent tools, list them all in one object:
+{{"tools": [{{"tool": "tool_name", "parameters": {{...}}}}, {{"tool": "other_tool", "parameters": {{...}}}}]}}
+
+Tool results are given back to you as a tool message. Summarize them in a clear,
+friendly way for the user. If you need more detail, make a narrower tool call.
+
 If you don't need a tool, respond normally in a friendly, concise way.
 Format information clearly for CLI display.
 
@@ -84,82 +150,126 @@ Examples:
 User: "Show me my emails"
 Assistant: {{"tool": "get_emails", "parameters": {{"limit": 10}}}}
 
+User: "Show me my unread emails and my tasks"
+Assistant: {{"tools": [{{"tool": "get_emails", "parameters": {{"filter": "unread"}}}}, {{"tool": "get_tasks", "parameters": {{}}}}]}}
+
 User: "What's the weather?"
 Assistant: I can help you with emails and tasks from Microsoft 365, but I don't have access to weather information.
 """
     
+    def _check_ollama(self):
+        """Warn once if the Ollama server is unreachable"""
+        self._ollama_checked = True
+        try:
+            response = self._http.get(f"{self.ollama_url}/api/tags", timeout=1)
+            if response.status_code != 200:
+                print(f"⚠️  Warning: Cannot connect to Ollama at {self.ollama_url}")
+        except Exception as e:
+            print(f"⚠️  Warning: Ollama connection failed: {e}")
+    
     def _call_ollama(self, messages):
-        """Call Ollama API"""
+        """Call Ollama API, yielding content chunks as they are generated"""
+        if not self._ollama_checked:
+            self._check_ollama()
+        
         url = f"{self.ollama_url}/api/chat"
         
         payload = {
             "model": self.ollama_model,
             "messages": messages,
-            "stream": False,
-            "options": {
-                "temperature": 0.7
-            }
+            "stream": True,
+            "options": self._ollama_options,
+            # Never unload the model between turns
+            "keep_alive": -1
         }
         
-        response = requests.post(url, json=payload)
-        
-        if response.status_code == 200:
-            return response.json()['message']['content']
-        else:
-            raise Exception(f"Ollama API error: {response.status_code}")
+        with self._http.post(url, data=orjson.dumps(payload), stream=True, timeout=OLLAMA_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise Exception(f"Ollama API error: {response.status_code}")
+            
+            # Ollama streams one JSON object per line
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                # Ollama reports failures mid-stream after a 200 status
+                if 'error' in chunk:
+                    raise Exception(f"Ollama API error: {chunk['error']}")
+                content = chunk.get('message', {}).get('content')
+                if content:
+                    yield content
+                if chunk.get('done'):
+                    break
+    
+    async def _acall_ollama(self, messages):
+        """Call Ollama API without blocking the event loop"""
+        response = await self._aclient.chat(
+            model=self.ollama_model,
+            messages=messages,
+            options=self._ollama_options,
+            keep_alive=-1
+        )
+        return response['message']['content']
     
     def process_request(self, user_input):
-        """Process user request and return response"""
+        """Process user request, yielding the response as it streams in"""
+        self._apply_summary()
+        # Start likely tool calls now so they overlap with the LLM deciding on one
+        self._prefetch_tools(user_input)
+        
         self.conversation_history.append({
             "role": "user",
             "content": user_input
         })
         
-        messages = [
-            {"role": "system", "content": self._create_system_prompt()}
-        ] + self.conversation_history
+        messages = [self._system_message, *self.conversation_history]
+        
+        # Get initial response from LLM. Tool calls are JSON objects, so anything
+        # starting with '{' is buffered silently instead of shown to the user
+        response_parts = []
+        buffering = None
+        for chunk in self._call_ollama(messages):
+            response_parts.append(chunk)
+            if buffering is None:
+                head = "".join(response_parts).lstrip()
+                if not head:
+                    continue
+                buffering = head.startswith('{')
+                if not buffering:
+                    yield head
+            elif not buffering:
+                yield chunk
         
-        # Get initial response from LLM
-        response_text = self._call_ollama(messages)
+        response_text = "".join(response_parts)
         
         # Check if response is a tool call
-        if self._is_tool_call(response_text):
-            try:
-                tool_call = json.loads(response_text)
-                tool_name = tool_call.get('tool')
-                parameters = tool_call.get('parameters', {})
-                
-                # Execute tool
-                tool_result = self.execute_tool(tool_name, parameters)
-                
-                # Add tool result to conversation
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": f"[Used tool: {tool_name}]"
-                })
-                
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": f"Tool result: {json.dumps(tool_result, indent=2)}\n\nPlease summarize this information in a clear, friendly way for the user."
-                })
-                
-                # Get final response
-                messages = [
-                    {"role": "system", "content": self._create_system_prompt()}
-                ] + self.conversation_history
-                
-                final_response = self._call_ollama(messages)
-                
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": final_response
-                })
-                
-                return final_response
-                
-            except json.JSONDecodeError:
-                # Not a valid tool call, treat as normal response
-                pass
+        tool_call = self._parse_tool_call(response_text) if buffering else None
+        if tool_call:
+            calls = self._tool_calls(tool_call)
+            
+            tool_results = self._run_tool_calls(calls)
+            
+            self._record_tool_results(self.conversation_history, calls, tool_results)
+            
+            # Get final response
+            messages = [self._system_message, *self.conversation_history]
+            
+            final_parts = []
+            for chunk in self._call_ollama(messages):
+                final_parts.append(chunk)
+                yield chunk
+            
+            self.conversation_history.append({
+                "role": "assistant",
+                "content": "".join(final_parts)
+            })
+            
+            self._compact_history(self.conversation_history)
+            return
+        
+        # Buffered text that turned out not to be a tool call
+        if buffering:
+            yield response_text
         
         # Normal response (no tool needed)
         self.conversation_history.append({
@@ -167,46 +277,277 @@ Assistant: I can help you with emails and tasks from Microsoft 365, but I don't
             "content": response_text
         })
         
+        self._compact_history(self.conversation_history)
+    
+    async def aprocess_request(self, user_input, history=None):
+        """Async variant of process_request; history defaults to the shared conversation"""
+        if history is None:
+            history = self.conversation_history
+        
+        history.append({
+            "role": "user",
+            "content": user_input
+        })
+        
+        messages = [self._system_message, *history]
+        
+        response_text = await self._acall_ollama(messages)
+        
+        tool_call = self._parse_tool_call(response_text)
+        if tool_call:
+            calls = self._tool_calls(tool_call)
+            
+            # All tools from this turn run concurrently, so latency is the slowest call
+            tool_results = await self._gather_tools(calls)
+            
+            self._record_tool_results(history, calls, tool_results)
+            
+            messages = [self._system_message, *history]
+            
+            final_response = await self._acall_ollama(messages)
+            
+            history.append({
+                "role": "assistant",
+                "content": final_response
+            })
+            
+            await self._acompact_history(history)
+            return final_response
+        
+        history.append({
+            "role": "assistant",
+            "content": response_text
+        })
+        
+        await self._acompact_history(history)
         return response_text
     
-    def _is_tool_call(self, text):
-        """Check if response is a tool call"""
-        text = text.strip()
-        if text.startswith('{') and text.endswith('}'):
+    async def aprocess_batch(self, inputs):
+        """Process several independent requests concurrently"""
+        # Each input gets its own copy of the history so concurrent turns don't interleave
+        return await asyncio.gather(*(
+            self.aprocess_request(user_input, history=list(self.conversation_history))
+            for user_input in inputs
+        ))
+    
+    def _prefetch_tools(self, user_input):
+        """Speculatively submit tool calls suggested by the user's wording"""
+        text = user_input.lower()
+        words = set(re.findall(r"[\w-]+", text))
+        # Anything left over from the previous turn is discarded. Reads are skipped when
+        # the input asks for a write, since the write would make them stale anyway
+        self._prefetched = {
+            tool_name: (params, self._pool.submit(self.execute_tool, tool_name, params))
+            for keywords, write_words, tool_name, params in self._prefetch_rules
+            if any(word in text for word in keywords) and not words & write_words
+        }
+    
+    def _take_prefetched(self, tool_name, parameters):
+        """Return the prefetched future for this tool call, or None if there isn't one"""
+        entry = self._prefetched.pop(tool_name, None)
+        if entry is None:
+            return None
+        
+        params, future = entry
+        if not isinstance(parameters, dict):
+            return None
+        if {k: v for k, v in parameters.items() if v is not None} != params:
+            return None
+        return future
+    
+    def _run_tool_calls(self, calls):
+        """Run a turn's tool calls on the pool; writes finish before any read starts"""
+        writes = [i for i, (tool_name, _) in enumerate(calls) if tool_name in WRITE_TOOLS]
+        futures = {}
+        if writes:
+            # Prefetched reads predate the write, so they can't be reused
+            self._prefetched = {}
+            for i in writes:
+                futures[i] = self._pool.submit(self.execute_tool, *calls[i])
+            concurrent.futures.wait(futures.values())
+        
+        # Reads run in parallel, reusing prefetched calls that match
+        for i, (tool_name, parameters) in enumerate(calls):
+            if i not in futures:
+                futures[i] = (
+                    self._take_prefetched(tool_name, parameters)
+                    or self._pool.submit(self.execute_tool, tool_name, parameters)
+                )
+        return [futures[i].result() for i in range(len(calls))]
+    
+    def _history_cut(self, history):
+        """Return how many of the oldest messages to summarize (0 if none)"""
+        if len(history) <= 2 * self._max_turns:
+            return 0
+        
+        # Cut at a user message so the kept window starts on a full turn
+        cut = len(history) // 2
+        while cut < len(history) and history[cut]['role'] != 'user':
+            cut += 1
+        return cut
+    
+    def _summary_messages(self, old_messages):
+        """Build the prompt that condenses old messages into a summary"""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in old_messages)
+        return [
+            {"role": "system", "content": "Summarize the prior dialogue between a user and their assistant in a few sentences. Keep names, email addresses, plan IDs, task titles and dates."},
+            {"role": "user", "content": transcript}
+        ]
+    
+    def _compact_history(self, history):
+        """Summarize the older half of a long history on the pool; _apply_summary swaps it in"""
+        cut = self._history_cut(history)
+        if cut and self._pending_summary is None:
+            old_messages = history[:cut]
+            future = self._pool.submit(self._summarize, old_messages)
+            self._pending_summary = (history, old_messages, future)
+    
+    def _summarize(self, old_messages):
+        """Condense old messages into summary text"""
+        return "".join(self._call_ollama(self._summary_messages(old_messages)))
+    
+    def _apply_summary(self):
+        """Replace the summarized messages once the background summary has finished"""
+        if self._pending_summary is None:
+            return
+        history, old_messages, future = self._pending_summary
+        if not future.done():
+            return
+        self._pending_summary = None
+        if future.cancelled() or future.exception() is not None:
+            return
+        
+        # Only swap if the summarized prefix is still untouched
+        if (history is self.conversation_history and len(history) >= len(old_messages)
+                and all(a is b for a, b in zip(history, old_messages))):
+            history[:len(old_messages)] = [{"role": "system", "content": f"Summary so far: {future.result()}"}]
+    
+    async def _acompact_history(self, history):
+        """Async variant of _compact_history"""
+        cut = self._history_cut(history)
+        if cut:
+            summary = await self._acall_ollama(self._summary_messages(history[:cut]))
+            history[:cut] = [{"role": "system", "content": f"Summary so far: {summary}"}]
+    
+    def _tool_calls(self, tool_call):
+        """Normalize a single or multi-tool call into a list of (tool_name, parameters)"""
+        entries = tool_call.get('tools')
+        if not isinstance(entries, list):
+            entries = [tool_call]
+        
+        calls = []
+        for entry in entries:
+            if not isinstance(entry, dict):
+                entry = {"tool": entry}
+            tool_name = entry.get('tool')
+            # Malformed names still go through execute_tool, which reports them as unknown
+            if not isinstance(tool_name, str):
+                tool_name = str(tool_name)
+            parameters = entry.get('parameters') or {}
+            if not isinstance(parameters, dict):
+                parameters = {}
+            calls.append((tool_name, parameters))
+        return calls
+    
+    def _record_tool_results(self, history, calls, results):
+        """Add the tool calls and their compact results to the history"""
+        # Results go in as one compact summary rather than raw JSON, so the history
+        # stays small in later prompts
+        tool_names = ", ".join(str(tool_name) for tool_name, _ in calls)
+        if len(calls) == 1:
+            content = self._format_tool_result(results[0])
+        else:
+            content = "\n\n".join(
+                f"{tool_name}:\n{self._format_tool_result(result)}"
+                for (tool_name, _), result in zip(calls, results)
+            )
+        
+        history.append({
+            "role": "assistant",
+            "content": f"[Used tool: {tool_names}]"
+        })
+        history.append({
+            "role": "tool",
+            "name": tool_names,
+            "content": content
+        })
+    
+    def _format_tool_result(self, result, max_items=10):
+        """Format a tool result as short bullet lines for the LLM"""
+        if 'error' in result:
+            return f"Error: {result['error']}"
+        
+        if 'emails' in result:
+            lines = [f"{result['count']} emails:"]
+            for email in result['emails'][:max_items]:
+                status = "read" if email['is_read'] else "unread"
+                lines.append(f"- [{status}] {email['subject']} from {email['from']} ({email['received']}): {email['preview']}")
+        elif 'tasks' in result:
+            lines = [f"{result['count']} tasks in plan {result['plan_id']}:"]
+            for task in result['tasks'][:max_items]:
+                due = task['due_date'] or "no due date"
+                lines.append(f"- {task['title']} ({task['percent_complete']}% done, {due}, priority {task['priority']}, id {task['id']})")
+        else:
+            return orjson.dumps(result).decode()
+        
+        if result['count'] > max_items:
+            lines.append(f"... and {result['count'] - max_items} more")
+        return "\n".join(lines)
+    
+    def _parse_tool_call(self, text):
+        """Return the tool call dict if the response is one, else None"""
+        # Single parse: the cheap brace check skips orjson for plain-text replies.
+        # orjson accepts surrounding whitespace, so the text is parsed as-is
+        if text.lstrip()[:1] == '{' and text.rstrip()[-1:] == '}':
             try:
-                data = json.loads(text)
-                return 'tool' in data
-            except:
-                return False
-        return False
+                data = orjson.loads(text)
+            except orjson.JSONDecodeError:
+                return None
+            if not isinstance(data, dict):
+                return None
+            tools = data.get('tools')
+            if 'tool' in data or (isinstance(tools, list) and tools):
+                return data
+        return None
     
     def execute_tool(self, function_name, arguments):
         """Execute the requested tool"""
+        method, params = self._tool_dispatch.get(function_name, (None, None))
+        if method is None:
+            return {"error": f"Unknown function: {function_name}"}
+        
         try:
-            if function_name == "get_emails":
-                return self.m365.get_emails(
-                    limit=arguments.get('limit', 10),
-                    filter_str=arguments.get('filter')
-                )
-            elif function_name == "send_email":
-                return self.m365.send_email(
-                    to=arguments['to'],
-                    subject=arguments['subject'],
-                    body=arguments['body']
-                )
-            elif function_name == "get_tasks":
-                return self.m365.get_tasks(
-                    plan_id=arguments.get('plan_id'),
-                    filter_str=arguments.get('filter')
-                )
-            elif function_name == "create_task":
-                return self.m365.create_task(
-                    plan_id=arguments['plan_id'],
-                    title=arguments['title'],
-                    description=arguments.get('description'),
-                    due_date=arguments.get('due_date')
-                )
-            else:
-                return {"error": f"Unknown function: {function_name}"}
+            # Missing required arguments surface as a TypeError below
+            return method(self.m365, **{params[k]: v for k, v in arguments.items() if k in params})
+        except Exception as e:
+            return {"error": str(e)}
+    
+    async def aexecute_tool(self, function_name, arguments):
+        """Async variant of execute_tool using the M365Client coroutine methods"""
+        method, params = self._atool_dispatch.get(function_name, (None, None))
+        if method is None:
+            return {"error": f"Unknown function: {function_name}"}
+        
+        try:
+            return await method(self.m365, **{params[k]: v for k, v in arguments.items() if k in params})
         except Exception as e:
             return {"error": str(e)}
+    
+    async def _gather_tools(self, calls):
+        """Run several (tool_name, parameters) calls concurrently; writes finish before reads"""
+        results = [None] * len(calls)
+        for phase in (True, False):
+            indices = [i for i, (tool_name, _) in enumerate(calls) if (tool_name in WRITE_TOOLS) is phase]
+            phase_results = await asyncio.gather(*(self.aexecute_tool(*calls[i]) for i in indices))
+            for i, result in zip(indices, phase_results):
+                results[i] = result
+        return results
+    
+    def close(self):
+        """Stop the prefetch pool without waiting on speculative calls still in flight"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+    
+    async def aclose(self):
+        """Release the async M365 session; await before the event loop used by aprocess_* ends"""
+        if hasattr(self, 'm365'):
+            await self.m365.aclose()
@@ -3,10 +3,60 @@ Microsoft 365 Client
 Handles authentication and API calls to M365 services
 """
 
+import asyncio
+import functools
 import os
+import threading
+import time
+from operator import itemgetter
+import aiohttp
+import ijson
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from cachetools import TTLCache
 from msal import ConfidentialClientApplication
 
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+
+# (connect, read) seconds for every Graph call, so a stalled request can't hang the CLI
+GRAPH_TIMEOUT = (3, 60)
+
+# Fields Graph always returns, fetched in a single call per item
+_email_fields = itemgetter('subject', 'from', 'receivedDateTime', 'bodyPreview', 'isRead')
+_task_fields = itemgetter('id', 'title', 'percentComplete')
+
+def _project_email(email):
+    """Reduce a Graph message to the fields the agent uses"""
+    subject, sender, received, preview, is_read = _email_fields(email)
+    return {
+        "subject": subject,
+        "from": sender['emailAddress']['address'],
+        "received": received,
+        "preview": preview[:100],
+        "is_read": is_read
+    }
+
+def _project_task(task):
+    """Reduce a Graph Planner task to the fields the agent uses"""
+    task_id, title, percent_complete = _task_fields(task)
+    return {
+        "id": task_id,
+        "title": title,
+        "percent_complete": percent_complete,
+        "due_date": task.get('dueDateTime'),
+        "priority": task.get('priority', 5)
+    }
+
+@functools.lru_cache(maxsize=128)
+def _parse_filter(filter_str):
+    """Translate an email filter ('unread', 'from:addr') into a Graph $filter, or None"""
+    if filter_str == "unread":
+        return "isRead eq false"
+    if filter_str and filter_str.startswith("from:"):
+        return f"from/emailAddress/address eq '{filter_str[5:].strip()}'"
+    return None
+
 class M365Client:
     def __init__(self):
         self.client_id = os.getenv('CLIENT_ID')
@@ -21,7 +71,26 @@ class M365Client:
             client_credential=self.client_secret
         )
         
+        # One pooled session so Graph calls reuse the same TLS connection
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+        
+        # plan_id -> first bucket id, so repeated task creation skips the bucket lookup
+        self._bucket_cache = {}
+        
+        # Short-lived caches for read calls, keyed by the call's parameters
+        self._email_cache = TTLCache(maxsize=128, ttl=60)
+        self._task_cache = TTLCache(maxsize=128, ttl=60)
+        # The agent may call into the client from worker threads
+        self._cache_lock = threading.Lock()
+        
+        # aiohttp session for the a* coroutine methods, created in the running event loop
+        self._asession = None
+        self._asession_loop = None
+        
         self.token = None
+        self._expires_at = 0
         self._authenticate()
     
     def _authenticate(self):
@@ -33,56 +102,77 @@ class M365Client:
         
         if "access_token" in result:
             self.token = result["access_token"]
+            # Refresh a couple of minutes early so a call never goes out with an expired token
+            self._expires_at = time.time() + result.get("expires_in", 3600) - 120
         else:
             raise Exception(f"Authentication failed: {result.get('error_description')}")
     
     def _get_headers(self):
-        """Get authorization headers"""
-        return {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json"
-        }
+        """Get authorization headers (Content-Type is set on the session)"""
+        if time.time() >= self._expires_at:
+            self._authenticate()
+        return {"Authorization": f"Bearer {self.token}"}
     
-    def get_emails(self, limit=10, filter_str=None):
-        """Retrieve emails from Outlook"""
-        url = "https://graph.microsoft.com/v1.0/me/messages"
+    async def _aget_headers(self):
+        """Async variant of _get_headers; token refresh runs off the event loop"""
+        if time.time() >= self._expires_at:
+            await asyncio.to_thread(self._authenticate)
+        return {"Authorization": f"Bearer {self.token}"}
+    
+    async def _ensure_session(self):
+        """Create the aiohttp session on first use in the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._asession is None or self._asession.closed or self._asession_loop is not loop:
+            if self._asession is not None:
+                # Left over from a previous event loop; close it so its connector isn't leaked
+                await self._asession.close()
+            self._asession = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=75),
+                headers={"Content-Type": "application/json"},
+                timeout=aiohttp.ClientTimeout(sock_connect=GRAPH_TIMEOUT[0], sock_read=GRAPH_TIMEOUT[1]),
+                json_serialize=lambda obj: orjson.dumps(obj).decode()
+            )
+            self._asession_loop = loop
+        return self._asession
+    
+    async def aclose(self):
+        """Close the aiohttp session used by the a* methods"""
+        if self._asession is not None:
+            await self._asession.close()
+            self._asession = None
+    
+    def _cached(self, cache, key):
+        """Look up a cached read result"""
+        with self._cache_lock:
+            return cache.get(key)
+    
+    def _store(self, cache, key, result):
+        """Cache a successful read result"""
+        with self._cache_lock:
+            cache[key] = result
+        return result
+    
+    def _invalidate(self, cache):
+        """Drop cached reads after a write"""
+        with self._cache_lock:
+            cache.clear()
+    
+    def _email_params(self, limit, filter_str):
+        """Build the Graph query parameters for get_emails"""
         params = {
             "$top": limit,
             "$orderby": "receivedDateTime DESC"
         }
         
-        if filter_str:
-            if filter_str == "unread":
-                params["$filter"] = "isRead eq false"
-            elif filter_str.startswith("from:"):
-                email = filter_str.split("from:")[1].strip()
-                params["$filter"] = f"from/emailAddress/address eq '{email}'"
-        
-        response = requests.get(url, headers=self._get_headers(), params=params)
+        email_filter = _parse_filter(filter_str)
+        if email_filter:
+            params["$filter"] = email_filter
         
-        if response.status_code == 200:
-            emails = response.json().get('value', [])
-            return {
-                "count": len(emails),
-                "emails": [
-                    {
-                        "subject": email['subject'],
-                        "from": email['from']['emailAddress']['address'],
-                        "received": email['receivedDateTime'],
-                        "preview": email.get('bodyPreview', '')[:100],
-                        "is_read": email['isRead']
-                    }
-                    for email in emails
-                ]
-            }
-        else:
-            return {"error": f"Failed to retrieve emails: {response.status_code}"}
+        return params
     
-    def send_email(self, to, subject, body):
-        """Send an email via Outlook"""
-        url = "https://graph.microsoft.com/v1.0/me/sendMail"
-        
-        email_data = {
+    def _email_payload(self, to, subject, body):
+        """Build the sendMail request body"""
+        return {
             "message": {
                 "subject": subject,
                 "body": {
@@ -98,96 +188,131 @@ class M365Client:
                 ]
             }
         }
+    
+    def _tasks_result(self, plan_id, tasks, filter_str):
+        """Filter and project Planner tasks into the result returned to the agent"""
+        if filter_str == "incomplete":
+            tasks = [t for t in tasks if t['percentComplete'] < 100]
+        
+        return {
+            "count": len(tasks),
+            "plan_id": plan_id,
+            "tasks": list(map(_project_task, tasks))
+        }
+    
+    def _task_payload(self, plan_id, bucket_id, title, due_date):
+        """Build the create-task request body"""
+        task_data = {
+            "planId": plan_id,
+            "bucketId": bucket_id,
+            "title": title
+        }
+        
+        if due_date:
+            task_data["dueDateTime"] = f"{due_date}T00:00:00Z"
+        
+        return task_data
+    
+    def get_emails(self, limit=10, filter_str=None):
+        """Retrieve emails from Outlook"""
+        cache_key = (limit, filter_str)
+        cached = self._cached(self._email_cache, cache_key)
+        if cached is not None:
+            return cached
+        
+        url = f"{GRAPH_URL}/me/messages"
+        params = self._email_params(limit, filter_str)
+        
+        # Stream the body and project each message as it is parsed, so the full
+        # payload (bodies, recipients, ...) is never held in memory at once
+        with self.session.get(url, headers=self._get_headers(), params=params, stream=True, timeout=GRAPH_TIMEOUT) as response:
+            if response.status_code != 200:
+                return {"error": f"Failed to retrieve emails: {response.status_code}"}
+            
+            response.raw.decode_content = True
+            emails = list(map(_project_email, ijson.items(response.raw, 'value.item')))
+        
+        return self._store(self._email_cache, cache_key, {"count": len(emails), "emails": emails})
+    
+    def send_email(self, to, subject, body):
+        """Send an email via Outlook"""
+        url = f"{GRAPH_URL}/me/sendMail"
+        email_data = self._email_payload(to, subject, body)
         
-        response = requests.post(url, headers=self._get_headers(), json=email_data)
+        response = self.session.post(url, headers=self._get_headers(), data=orjson.dumps(email_data), timeout=GRAPH_TIMEOUT)
         
         if response.status_code == 202:
+            self._invalidate(self._email_cache)
             return {"status": "success", "message": f"Email sent to {to}"}
         else:
             return {"error": f"Failed to send email: {response.status_code}"}
     
     def get_tasks(self, plan_id=None, filter_str=None):
         """Retrieve tasks from Microsoft Planner"""
+        cache_key = (plan_id, filter_str)
+        cached = self._cached(self._task_cache, cache_key)
+        if cached is not None:
+            return cached
+        
         # First, get user's plans if no plan_id provided
         if not plan_id:
-            plans_url = "https://graph.microsoft.com/v1.0/me/planner/plans"
-            response = requests.get(plans_url, headers=self._get_headers())
+            plans_url = f"{GRAPH_URL}/me/planner/plans"
+            response = self.session.get(plans_url, headers=self._get_headers(), timeout=GRAPH_TIMEOUT)
             
             if response.status_code != 200:
                 return {"error": "Failed to retrieve plans"}
             
-            plans = response.json().get('value', [])
+            plans = orjson.loads(response.content).get('value', [])
             if not plans:
                 return {"error": "No plans found"}
             
             plan_id = plans[0]['id']  # Use first plan
         
         # Get tasks for the plan
-        url = f"https://graph.microsoft.com/v1.0/planner/plans/{plan_id}/tasks"
-        response = requests.get(url, headers=self._get_headers())
+        url = f"{GRAPH_URL}/planner/plans/{plan_id}/tasks"
+        response = self.session.get(url, headers=self._get_headers(), timeout=GRAPH_TIMEOUT)
         
         if response.status_code == 200:
-            tasks = response.json().get('value', [])
-            
-            # Apply filter
-            if filter_str == "incomplete":
-                tasks = [t for t in tasks if t['percentComplete'] < 100]
-            
-            return {
-                "count": len(tasks),
-                "plan_id": plan_id,
-                "tasks": [
-                    {
-                        "id": task['id'],
-                        "title": task['title'],
-                        "percent_complete": task['percentComplete'],
-                        "due_date": task.get('dueDateTime'),
-                        "priority": task.get('priority', 5)
-                    }
-                    for task in tasks
-                ]
-            }
+            tasks = orjson.loads(response.content).get('value', [])
+            return self._store(self._task_cache, cache_key, self._tasks_result(plan_id, tasks, filter_str))
         else:
             return {"error": f"Failed to retrieve tasks: {response.status_code}"}
     
     def create_task(self, plan_id, title, description=None, due_date=None):
         """Create a new task in Microsoft Planner"""
-        # First, get a bucket from the plan
-        buckets_url = f"https://graph.microsoft.com/v1.0/planner/plans/{plan_id}/buckets"
-        response = requests.get(buckets_url, headers=self._get_headers())
-        
-        if response.status_code != 200:
-            return {"error": "Failed to retrieve buckets"}
-        
-        buckets = response.json().get('value', [])
-        if not buckets:
-            return {"error": "No buckets found in plan"}
-        
-        bucket_id = buckets[0]['id']
+        # First, get a bucket from the plan (cached per plan)
+        bucket_id = self._bucket_cache.get(plan_id)
+        if bucket_id is None:
+            buckets_url = f"{GRAPH_URL}/planner/plans/{plan_id}/buckets"
+            response = self.session.get(buckets_url, headers=self._get_headers(), timeout=GRAPH_TIMEOUT)
+            
+            if response.status_code != 200:
+                return {"error": "Failed to retrieve buckets"}
+            
+            buckets = orjson.loads(response.content).get('value', [])
+            if not buckets:
+                return {"error": "No buckets found in plan"}
+            
+            bucket_id = buckets[0]['id']
+            self._bucket_cache[plan_id] = bucket_id
         
         # Create task
-        url = "https://graph.microsoft.com/v1.0/planner/tasks"
-        task_data = {
-            "planId": plan_id,
-            "bucketId": bucket_id,
-            "title": title
-        }
-        
-        if due_date:
-            task_data["dueDateTime"] = f"{due_date}T00:00:00Z"
+        url = f"{GRAPH_URL}/planner/tasks"
+        task_data = self._task_payload(plan_id, bucket_id, title, due_date)
         
-        response = requests.post(url, headers=self._get_headers(), json=task_data)
+        response = self.session.post(url, headers=self._get_headers(), data=orjson.dumps(task_data), timeout=GRAPH_TIMEOUT)
         
         if response.status_code == 201:
-            task = response.json()
+            self._invalidate(self._task_cache)
+            task = orjson.loads(response.content)
             
             # Add description if provided
             if description:
-                details_url = f"https://graph.microsoft.com/v1.0/planner/tasks/{task['id']}/details"
+                details_url = f"{GRAPH_URL}/planner/tasks/{task['id']}/details"
                 details_data = {
                     "description": description
                 }
-                requests.patch(details_url, headers=self._get_headers(), json=details_data)
+                self.session.patch(details_url, headers=self._get_headers(), data=orjson.dumps(details_data), timeout=GRAPH_TIMEOUT)
             
             return {
                 "status": "success",
@@ -196,3 +321,117 @@ class M365Client:
             }
         else:
             return {"error": f"Failed to create task: {response.status_code}"}
+    
+    # Coroutine versions of the Graph calls. They share one aiohttp session so
+    # concurrent calls reuse pooled connections, and reuse the helpers above
+    
+    async def aget_emails(self, limit=10, filter_str=None):
+        """Async variant of get_emails"""
+        cache_key = (limit, filter_str)
+        cached = self._cached(self._email_cache, cache_key)
+        if cached is not None:
+            return cached
+        
+        session = await self._ensure_session()
+        url = f"{GRAPH_URL}/me/messages"
+        params = self._email_params(limit, filter_str)
+        
+        async with session.get(url, headers=await self._aget_headers(), params=params) as response:
+            if response.status != 200:
+                return {"error": f"Failed to retrieve emails: {response.status}"}
+            # ijson reads the aiohttp stream incrementally, as in get_emails
+            emails = [
+                _project_email(email)
+                async for email in ijson.items(response.content, 'value.item')
+            ]
+        
+        return self._store(self._email_cache, cache_key, {"count": len(emails), "emails": emails})
+    
+    async def asend_email(self, to, subject, body):
+        """Async variant of send_email"""
+        session = await self._ensure_session()
+        url = f"{GRAPH_URL}/me/sendMail"
+        email_data = self._email_payload(to, subject, body)
+        
+        async with session.post(url, headers=await self._aget_headers(), json=email_data) as response:
+            if response.status != 202:
+                return {"error": f"Failed to send email: {response.status}"}
+        
+        self._invalidate(self._email_cache)
+        return {"status": "success", "message": f"Email sent to {to}"}
+    
+    async def aget_tasks(self, plan_id=None, filter_str=None):
+        """Async variant of get_tasks"""
+        cache_key = (plan_id, filter_str)
+        cached = self._cached(self._task_cache, cache_key)
+        if cached is not None:
+            return cached
+        
+        session = await self._ensure_session()
+        
+        # First, get user's plans if no plan_id provided
+        if not plan_id:
+            plans_url = f"{GRAPH_URL}/me/planner/plans"
+            async with session.get(plans_url, headers=await self._aget_headers()) as response:
+                if response.status != 200:
+                    return {"error": "Failed to retrieve plans"}
+                plans = (await response.json(loads=orjson.loads)).get('value', [])
+            
+            if not plans:
+                return {"error": "No plans found"}
+            
+            plan_id = plans[0]['id']  # Use first plan
+        
+        # Get tasks for the plan
+        url = f"{GRAPH_URL}/planner/plans/{plan_id}/tasks"
+        async with session.get(url, headers=await self._aget_headers()) as response:
+            if response.status != 200:
+                return {"error": f"Failed to retrieve tasks: {response.status}"}
+            tasks = (await response.json(loads=orjson.loads)).get('value', [])
+        
+        return self._store(self._task_cache, cache_key, self._tasks_result(plan_id, tasks, filter_str))
+    
+    async def acreate_task(self, plan_id, title, description=None, due_date=None):
+        """Async variant of create_task"""
+        session = await self._ensure_session()
+        
+        # First, get a bucket from the plan (cached per plan)
+        bucket_id = self._bucket_cache.get(plan_id)
+        if bucket_id is None:
+            buckets_url = f"{GRAPH_URL}/planner/plans/{plan_id}/buckets"
+            async with session.get(buckets_url, headers=await self._aget_headers()) as response:
+                if response.status != 200:
+                    return {"error": "Failed to retrieve buckets"}
+                buckets = (await response.json(loads=orjson.loads)).get('value', [])
+            
+            if not buckets:
+                return {"error": "No buckets found in plan"}
+            
+            bucket_id = buckets[0]['id']
+            self._bucket_cache[plan_id] = bucket_id
+        
+        # Create task
+        url = f"{GRAPH_URL}/planner/tasks"
+        task_data = self._task_payload(plan_id, bucket_id, title, due_date)
+        
+        async with session.post(url, headers=await self._aget_headers(), json=task_data) as response:
+            if response.status != 201:
+                return {"error": f"Failed to create task: {response.status}"}
+            task = await response.json(loads=orjson.loads)
+        
+        self._invalidate(self._task_cache)
+        
+        # Add description if provided
+        if description:
+            details_url = f"{GRAPH_URL}/planner/tasks/{task['id']}/details"
+            details_data = {
+                "description": description
+            }
+            async with session.patch(details_url, headers=await self._aget_headers(), json=details_data):
+                pass
+        
+        return {
+            "status": "success",
+            "task_id": task['id'],
+            "title": task['title']
+        }
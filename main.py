@@ -14,7 +14,7 @@ def main():
     
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Personal Assistant AI Agent')
-    parser.add_argument('--model', default='llama3.1', help='Ollama model to use (default: llama3.1)')
+    parser.add_argument('--model', default='llama3.1:8b-instruct-q4_K_M', help='Ollama model to use (default: llama3.1:8b-instruct-q4_K_M)')
     parser.add_argument('--ollama-url', default='http://localhost:11434', help='Ollama API URL')
     args = parser.parse_args()
     
@@ -60,14 +60,18 @@ def main():
                 continue
             
             print("\n🤔 Thinking...")
-            response = assistant.process_request(user_input)
-            print(f"\r🤖 Assistant: {response}\n")
+            print("\r🤖 Assistant: ", end="", flush=True)
+            for token in assistant.process_request(user_input):
+                print(token, end="", flush=True)
+            print("\n")
             
         except KeyboardInterrupt:
             print("\n\n👋 Goodbye!")
             break
         except Exception as e:
             print(f"\n❌ Error: {str(e)}\n")
+    
+    assistant.close()
 
 if __name__ == "__main__":
     main()